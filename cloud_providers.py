@@ -1,9 +1,356 @@
+from __future__ import annotations
 import os
+import base64
+import contextlib
+import functools
+import hashlib
+import json
 import logging
+import mmap
 import shutil
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable
 
 log = logging.getLogger(__name__)
 
+S3_MULTIPART_THRESHOLD = 8 * 1024 * 1024
+S3_MULTIPART_CHUNKSIZE = 16 * 1024 * 1024
+S3_MAX_CONCURRENCY = 10
+# uploads running at the same time, as the tables of an export or the jobs of upload_many
+MAX_CONCURRENT_UPLOADS = 8
+S3_IO_CHUNKSIZE = 1024 * 1024
+# concurrent uploads share the cached client, so its pool has a connection for every transfer thread
+S3_MAX_POOL_CONNECTIONS = MAX_CONCURRENT_UPLOADS * S3_MAX_CONCURRENCY
+S3_RETRIES = {"mode": "adaptive", "max_attempts": 5}
+
+GCS_CHUNK_SIZE = 32 * 1024 * 1024
+GCS_MAX_WORKERS = 8
+# google-cloud-storage sends files up to this size in a single multipart request
+GCS_MULTIPART_UPLOAD_SIZE = 8 * 1024 * 1024
+
+AZURE_MAX_CONCURRENCY = 8
+FILE_READ_BUFFER_SIZE = 1024 * 1024
+
+HOOK_CACHE_TTL = 300
+
+# Hooks keep their SDK client (and its connection pool) alive, so reusing them
+# across uploads avoids re-reading the connection and new TLS handshakes per file.
+_HOOK_CACHE: dict[tuple[str, str], tuple[float, Any]] = {}
+_HOOK_CACHE_LOCK = threading.Lock()
+
+
+def _cached_hook(provider: str, key: str, factory: Callable[[], Any]) -> Any:
+    """
+    Returns the hook cached for the given provider and key, building it with factory when missing or expired.
+
+    Args:
+        provider (str): The name of the cloud provider.
+        key (str): The value identifying the credentials of the hook, usually the connection ID.
+        factory (Callable): Callable building a new hook.
+
+    Returns:
+        Any: The cached hook instance.
+    """
+    now = time.monotonic()
+    with _HOOK_CACHE_LOCK:
+        cached = _HOOK_CACHE.get((provider, key))
+        if cached is None or now - cached[0] > HOOK_CACHE_TTL:
+            cached = (now, factory())
+            _HOOK_CACHE[(provider, key)] = cached
+    return cached[1]
+
+
+# Provider SDKs are imported lazily, on the first upload that needs them, and only once.
+@functools.lru_cache(maxsize=None)
+def _s3hook_cls():
+    from airflow.providers.amazon.aws.hooks.s3 import S3Hook
+
+    return S3Hook
+
+
+@functools.lru_cache(maxsize=None)
+def _gcshook_cls():
+    from airflow.providers.google.cloud.hooks.gcs import GCSHook
+
+    return GCSHook
+
+
+@functools.lru_cache(maxsize=None)
+def _wasbhook_cls():
+    from airflow.providers.microsoft.azure.hooks.wasb import WasbHook
+
+    return WasbHook
+
+
+def _copy_file(src: str, dst: str | Path) -> None:
+    """
+    Copies a file inside the kernel with copy_file_range (a reflink on copy-on-write filesystems) or sendfile,
+    falling back to a buffered userspace copy where neither is available.
+
+    Args:
+        src (str): The path of the file to copy.
+        dst (str | Path): The path of the copy.
+    """
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        size = os.fstat(fsrc.fileno()).st_size
+        copied = 0
+        try:
+            while copied < size:
+                sent = os.copy_file_range(fsrc.fileno(), fdst.fileno(), size - copied)
+                if not sent:
+                    break
+                copied += sent
+        except (AttributeError, OSError):
+            try:
+                while copied < size:
+                    sent = os.sendfile(
+                        fdst.fileno(), fsrc.fileno(), copied, size - copied
+                    )
+                    if not sent:
+                        break
+                    copied += sent
+            except (AttributeError, OSError):
+                fsrc.seek(copied)
+                shutil.copyfileobj(fsrc, fdst, FILE_READ_BUFFER_SIZE)
+
+
+def _md5():
+    try:
+        return hashlib.md5(usedforsecurity=False)
+    except TypeError:
+        return hashlib.md5()
+
+
+class HashingReader:
+    """
+    Wraps a binary file object and computes the MD5 digest of the data while the upload reads it,
+    so the content is hashed without a second pass over the file. Every offset is hashed once, in order:
+    data read again after a seek back, e.g. when a resumable upload retries a chunk, is not hashed twice.
+    """
+
+    def __init__(self, file_obj):
+        self.file_obj = file_obj
+        self.md5 = _md5()
+        self._position = file_obj.tell()
+        # the digest covers the data from offset 0 up to here
+        self._hashed = 0
+
+    def read(self, size: int = -1) -> bytes:
+        if self._position > self._hashed:
+            # a seek skipped data that was never hashed, so it is read and hashed first
+            self.file_obj.seek(self._hashed)
+            self.md5.update(self.file_obj.read(self._position - self._hashed))
+            self._hashed = self._position
+        data = self.file_obj.read(size)
+        end = self._position + len(data)
+        if end > self._hashed:
+            self.md5.update(memoryview(data)[self._hashed - self._position :])
+            self._hashed = end
+        self._position = end
+        return data
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        self.file_obj.seek(offset, whence)
+        self._position = self.file_obj.tell()
+        return self._position
+
+    def b64digest(self) -> str:
+        return base64.b64encode(self.md5.digest()).decode()
+
+
+def _file_md5(source, chunk_size: int = 0) -> list:
+    """
+    Hashes a file through a read-only memory map, as a whole or in consecutive chunks. An open file object
+    is read chunk by chunk instead and rewound to its start afterwards.
+
+    Args:
+        source (str | BinaryIO): The path to the file, which must not be empty, or an open binary file.
+        chunk_size (int): The size of the chunks to hash separately. 0 hashes the whole file.
+
+    Returns:
+        list: The MD5 hash objects, one per chunk.
+    """
+    if not isinstance(source, (str, Path)):
+        digests = []
+        source.seek(0)
+        try:
+            while data := source.read(chunk_size or -1):
+                digest = _md5()
+                digest.update(data)
+                digests.append(digest)
+        finally:
+            source.seek(0)
+        return digests
+    with open(source, "rb") as f, mmap.mmap(
+        f.fileno(), 0, access=mmap.ACCESS_READ
+    ) as mm:
+        view = memoryview(mm)
+        try:
+            step = chunk_size or len(mm)
+            digests = []
+            for offset in range(0, len(mm), step):
+                digest = _md5()
+                digest.update(view[offset : offset + step])
+                digests.append(digest)
+            return digests
+        finally:
+            view.release()
+
+
+def _s3_etag(source, size: int) -> str:
+    """
+    Computes the ETag S3 reports for the file once uploaded by S3Transfer: the MD5 of the content for a
+    single PUT, or the MD5 of the part digests followed by the part count for a multipart upload.
+    """
+    if size < S3_MULTIPART_THRESHOLD:
+        return _file_md5(source)[0].hexdigest()
+    parts = _file_md5(source, S3_MULTIPART_CHUNKSIZE)
+    combined = _md5()
+    combined.update(b"".join(part.digest() for part in parts))
+    return f"{combined.hexdigest()}-{len(parts)}"
+
+
+def _service_account_info(secret: str | None) -> dict | None:
+    """
+    Returns the parsed service account key when the secret holds one in JSON form, None otherwise.
+    """
+    try:
+        info = json.loads(secret or "")
+    except ValueError:
+        return None
+    if isinstance(info, dict) and info.get("type") == "service_account":
+        return info
+    return None
+
+
+def shard_key(key: str, shards: int) -> str:
+    """
+    Prefixes an object key with a stable shard number, spreading uploads over several S3 key prefixes
+    (and so several S3 partitions) instead of a single release prefix.
+
+    Readers find an object again with the same computation: the shard of "<release>/<file>" is
+    zlib.crc32(key) % shards, written as two digits, e.g. "05/<release>/<file>".
+
+    Args:
+        key (str): The object key.
+        shards (int): The number of prefixes to spread keys over. 0 or 1 disables sharding.
+
+    Returns:
+        str: The key to upload to.
+    """
+    if shards <= 1:
+        return key
+    return f"{zlib.crc32(key.encode()) % shards:02d}/{key}"
+
+
+def _check_source_file(file_path: str) -> int:
+    """
+    Validates the file to upload before any connection is made or file handle opened.
+
+    Args:
+        file_path (str): The path to the file to be uploaded.
+
+    Returns:
+        int: The size of the file in bytes.
+
+    Raises:
+        ValueError: If the file is empty.
+    """
+    size = os.stat(file_path).st_size
+    if size == 0:
+        raise ValueError(f"Refusing to upload empty file {file_path}")
+    return size
+
+
+def _source_size(**kwargs) -> int:
+    """
+    Validates the source of an upload, the file at file_path or the open binary file object file_obj,
+    before any connection is made.
+
+    Args:
+        file_path (str): The path to the file to be uploaded.
+        file_obj (BinaryIO): An open binary file uploaded instead of file_path. It is rewound to its start.
+        file_name (str): The name of the file to be uploaded.
+
+    Returns:
+        int: The size of the source in bytes.
+
+    Raises:
+        ValueError: If the source is empty.
+    """
+    file_obj = kwargs.get("file_obj")
+    if file_obj is None:
+        return _check_source_file(kwargs["file_path"])
+    file_obj.seek(0, os.SEEK_END)
+    size = file_obj.tell()
+    file_obj.seek(0)
+    if size == 0:
+        raise ValueError(f"Refusing to upload empty file {kwargs['file_name']}")
+    return size
+
+
+def _open_source(**kwargs):
+    """
+    Opens the file at file_path for reading, or hands out file_obj as is, leaving it open for its owner.
+    """
+    if kwargs.get("file_obj") is not None:
+        return contextlib.nullcontext(kwargs["file_obj"])
+    return open(kwargs["file_path"], "rb", buffering=FILE_READ_BUFFER_SIZE)
+
+
+def _build_s3_hook(conn_id: str):
+    """
+    Builds the S3Hook of the connection with the client tuned for concurrent transfers. The tuning is
+    merged under the botocore config of the connection extra instead of being passed to the hook, which
+    would replace that config, so settings of the connection (e.g. addressing style, signature version,
+    proxies or timeouts of S3 compatible stores) keep applying and win over the defaults here.
+
+    Args:
+        conn_id (str): The connection ID for the AWS account.
+
+    Returns:
+        S3Hook: The hook used to upload files.
+    """
+    from botocore.config import Config
+
+    s3Class = _s3hook_cls()(aws_conn_id=conn_id)
+    conn_config = s3Class.conn_config
+    tuning = Config(
+        tcp_keepalive=True,
+        max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+        retries=S3_RETRIES,
+    )
+    if conn_config.botocore_config is not None:
+        tuning = tuning.merge(conn_config.botocore_config)
+    conn_config.botocore_config = tuning
+    return s3Class
+
+
+# Keyed on the cached hook, so the check runs again once the hook expires and is rebuilt.
+@functools.lru_cache(maxsize=32)
+def _ensure_s3_bucket(s3Class, bucket_name: str) -> None:
+    """
+    Checks the bucket once, instead of sending a HEAD bucket request before every upload. A failed check
+    never fails the upload: check_for_bucket also reports False on a 403, and credentials allowed to put
+    objects without s3:ListBucket still upload fine. A bucket that really is missing fails the upload itself.
+
+    Args:
+        s3Class (S3Hook): The cached hook of the connection.
+        bucket_name (str): The name of the S3 bucket.
+    """
+    if not s3Class.check_for_bucket(bucket_name=bucket_name):
+        log.warning(
+            "Could not confirm bucket %s exists, it may be missing or not listable with the connection",
+            bucket_name,
+        )
+
 
 class CloudProvider:
     def __init__(self, provider: str, **kwargs):
@@ -26,6 +373,62 @@ class CloudProvider:
         """
         raise NotImplementedError
 
+    def _is_unchanged(
+        self, client, bucket_name: str, file_name: str, source, size: int
+    ) -> bool:
+        """
+        Tells whether the destination already holds an object with the same content as the source.
+
+        Args:
+            client (Any): The hook or client of the provider.
+            bucket_name (str): The name of the bucket.
+            file_name (str): The name of the object in the bucket.
+            source (str | BinaryIO): The path to the local file, or the file object uploaded instead.
+            size (int): The size of the source in bytes.
+
+        Returns:
+            bool: True when the upload can be skipped.
+        """
+        return False
+
+    def _check_errors(self) -> tuple:
+        """
+        Returns the exception types of the provider's client a failing _is_unchanged check raises.
+        """
+        return ()
+
+    def _already_uploaded(self, client, **kwargs) -> bool:
+        """
+        Runs the _is_unchanged check of the provider for an upload. A check failing with an error of the
+        provider's client, e.g. because the credentials may write objects but not read their metadata,
+        is logged and never fails the upload itself.
+        The source is only hashed when the destination holds an object of the same name and size.
+        """
+        if not kwargs.get("skip_unchanged", True):
+            return False
+        source = kwargs.get("file_obj")
+        try:
+            unchanged = self._is_unchanged(
+                client,
+                kwargs["bucket_name"],
+                kwargs["file_name"],
+                kwargs["file_path"] if source is None else source,
+                kwargs["size"],
+            )
+        except self._check_errors() as e:
+            log.warning(
+                "Could not compare %s with the destination, uploading it: %s", kwargs["file_name"], e
+            )
+            return False
+        if unchanged:
+            log.info(
+                "%s already present in %s bucket %s with the same content, skipping upload",
+                kwargs["file_name"],
+                self.provider,
+                kwargs["bucket_name"],
+            )
+        return unchanged
+
 
 class AwsCloudProvider(CloudProvider):
     def __init__(self, provider: str, **kwargs):
@@ -38,29 +441,79 @@ class AwsCloudProvider(CloudProvider):
         """
         super().__init__(provider, **kwargs)
 
+    def _check_errors(self) -> tuple:
+        from botocore.exceptions import BotoCoreError, ClientError
+
+        return BotoCoreError, ClientError
+
+    def _is_unchanged(
+        self, s3Class, bucket_name: str, file_name: str, source, size: int
+    ) -> bool:
+        head = s3Class.head_object(key=file_name, bucket_name=bucket_name)
+        return (
+            bool(head)
+            and head["ContentLength"] == size
+            and head["ETag"].strip('"') == _s3_etag(source, size)
+        )
+
     def upload(self, **kwargs) -> tuple:
         """
-        Uploads a file to an Amazon S3 bucket using the S3Hook class.
+        Uploads a file to an Amazon S3 bucket using the S3Hook connection and boto3's managed transfer,
+        which splits large files into parts uploaded in parallel.
+
+        Args:
+            conn_id (str): The connection ID for the AWS account.
+            bucket_name (str): The name of the S3 bucket.
+            file_path (str): The path to the file to be uploaded.
+            file_name (str): The name of the file to be uploaded.
+            file_obj (BinaryIO): An open binary file to upload instead of file_path, e.g. a spooled export. Not closed.
+            release_name (str): The name of the release.
+            prefix_shards (int): The number of hashed key prefixes to spread uploads over. Default 0 (disabled).
+            skip_unchanged (bool): Skip the upload when the destination already holds the same content. Default True.
 
         Returns:
             tuple: A tuple containing a boolean value indicating success or failure, the release name, the provider, and any exception that occurred.
         """
         try:
-            from airflow.providers.amazon.aws.hooks.s3 import S3Hook
+            from boto3.s3.transfer import S3Transfer, TransferConfig
 
-            logging.info(
+            size = _source_size(**kwargs)
+            log.debug(
                 "Connecting to aws s3 service to validate bucket connection........"
             )
-            s3Class = S3Hook(aws_conn_id=kwargs["conn_id"])
-            s3Class.check_for_bucket(bucket_name=kwargs["bucket_name"])
-            with open(kwargs["file_path"], "rb") as f:
-                s3Class._upload_file_obj(
-                    file_obj=f,
-                    key=kwargs["file_name"],
-                    bucket_name=kwargs["bucket_name"],
-                    replace=True,
+            s3Class = _cached_hook(
+                self.provider,
+                kwargs["conn_id"],
+                lambda: _build_s3_hook(kwargs["conn_id"]),
+            )
+            _ensure_s3_bucket(s3Class, kwargs["bucket_name"])
+            key = shard_key(kwargs["file_name"], kwargs.get("prefix_shards", 0))
+            if self._already_uploaded(
+                s3Class, **{**kwargs, "file_name": key, "size": size}
+            ):
+                return True, kwargs["release_name"], self.provider, None
+            # the transfer switches to parallel multipart PUTs above the threshold
+            transferConfig = TransferConfig(
+                multipart_threshold=S3_MULTIPART_THRESHOLD,
+                multipart_chunksize=S3_MULTIPART_CHUNKSIZE,
+                max_concurrency=S3_MAX_CONCURRENCY,
+                io_chunksize=S3_IO_CHUNKSIZE,
+                use_threads=True,
+            )
+            if kwargs.get("file_obj") is not None:
+                s3Class.get_conn().upload_fileobj(
+                    kwargs["file_obj"], kwargs["bucket_name"], key, Config=transferConfig
                 )
-            log.info("data sent to s3 bucket sucessfully")
+            else:
+                # leaving the block shuts the transfer manager and its thread pool down
+                with S3Transfer(s3Class.get_conn(), transferConfig) as transfer:
+                    transfer.upload_file(kwargs["file_path"], kwargs["bucket_name"], key)
+            log.info(
+                "Uploaded %s to %s bucket %s",
+                key,
+                self.provider,
+                kwargs["bucket_name"],
+            )
             return True, kwargs["release_name"], self.provider, None
         except Exception as e:
             return False, kwargs["release_name"], self.provider, e
@@ -77,6 +530,149 @@ class GcsCloudProvider(CloudProvider):
         """
         super().__init__(provider, **kwargs)
 
+    def _build_hook(self, **kwargs):
+        """
+        Builds the GCSHook, configuring the default google connection from the secret environment variable when no conn_id is given.
+
+        Args:
+            conn_id (str): The connection ID for the Google Cloud Storage (GCS) account.
+            provider_secret_env_name (str): The name of the environment variable containing the credentials for the GCS account.
+
+        Returns:
+            GCSHook: The hook used to upload files.
+        """
+        if not kwargs["conn_id"] or kwargs["conn_id"] is None:
+            secret = os.getenv(kwargs["provider_secret_env_name"])
+            if secret == "google-cloud-platform://":
+                log.debug(
+                    "configuring workload identity for  google connection flow"
+                )
+                os.environ[
+                    "AIRFLOW_CONN_GOOGLE_CLOUD_DEFAULT"
+                ] = "google-cloud-platform://"
+            elif (service_account_info := _service_account_info(secret)) is not None:
+                log.debug("configuring service account key credentials in memory")
+                return self._build_hook_from_key(service_account_info)
+            else:
+                log.debug(
+                    "fallback to google connection default connection flow"
+                )
+                os.environ["AIRFLOW_CONN_GOOGLE_CLOUD_DEFAULT"] = secret
+                os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = secret
+            return _gcshook_cls()()
+        else:
+            log.debug(
+                "Connecting to google service using conn_id flow for workload identity"
+            )
+            if kwargs["conn_id"] == "google-cloud-platform://":
+                log.debug("configuring workload identity for conn_id flow")
+                os.environ[
+                    "AIRFLOW_CONN_GOOGLE_CLOUD_DEFAULT"
+                ] = "google-cloud-platform://"
+                return _gcshook_cls()()
+            else:
+                log.debug("Connecting to google service using conn_id flow")
+                return _gcshook_cls()(gcp_conn_id=kwargs["conn_id"])
+
+    def _build_hook_from_key(self, service_account_info: dict):
+        """
+        Builds a GCSHook whose storage client uses the given service account key, without writing the key
+        to the process environment.
+
+        Args:
+            service_account_info (dict): The parsed service account key.
+
+        Returns:
+            GCSHook: The hook used to upload files.
+        """
+        from google.cloud import storage
+        from google.oauth2 import service_account
+
+        credentials = service_account.Credentials.from_service_account_info(
+            service_account_info
+        )
+        gcsClass = _gcshook_cls()()
+        gcsClass._conn = storage.Client(
+            credentials=credentials, project=service_account_info.get("project_id")
+        )
+        return gcsClass
+
+    def _check_errors(self) -> tuple:
+        from google.api_core.exceptions import GoogleAPIError
+        from google.auth.exceptions import GoogleAuthError
+
+        return GoogleAPIError, GoogleAuthError
+
+    def _is_unchanged(
+        self, gcsClass, bucket_name: str, file_name: str, source, size: int
+    ) -> bool:
+        # objects composed from chunks have no MD5 and are always uploaded again
+        blob = gcsClass.get_conn().bucket(bucket_name).get_blob(file_name)
+        return (
+            blob is not None
+            and blob.size == size
+            and blob.md5_hash
+            == base64.b64encode(_file_md5(source)[0].digest()).decode()
+        )
+
+    def _upload_chunks(self, gcsClass, **kwargs) -> None:
+        """
+        Uploads a large file as chunks sent in parallel and composed server side (XML multipart upload).
+        Falls back to a single upload when the installed google-cloud-storage has no transfer manager.
+
+        Args:
+            gcsClass (GCSHook): The hook used to upload files.
+            bucket_name (str): The name of the GCS bucket.
+            file_path (str): The path to the file to be uploaded.
+            file_name (str): The name of the file to be uploaded.
+        """
+        try:
+            from google.cloud.storage import transfer_manager
+        except ImportError:
+            gcsClass.upload(
+                bucket_name=kwargs["bucket_name"],
+                filename=kwargs["file_path"],
+                object_name=kwargs["file_name"],
+            )
+            return
+        blob = gcsClass.get_conn().bucket(kwargs["bucket_name"]).blob(kwargs["file_name"])
+        transfer_manager.upload_chunks_concurrently(
+            kwargs["file_path"],
+            blob,
+            chunk_size=GCS_CHUNK_SIZE,
+            max_workers=GCS_MAX_WORKERS,
+            # threads, as forking the webserver process for each upload is not an option
+            worker_type=transfer_manager.THREAD,
+        )
+
+    def _upload_verified(self, gcsClass, **kwargs) -> None:
+        """
+        Uploads a small file in a single request, or a file object of any size in resumable chunks, hashing
+        it while it is read and checking the digest against the MD5 computed by GCS, instead of letting
+        the client library hash the file itself.
+
+        Args:
+            gcsClass (GCSHook): The hook used to upload files.
+            bucket_name (str): The name of the GCS bucket.
+            file_path (str): The path to the file to be uploaded.
+            file_obj (BinaryIO): An open binary file to upload instead of file_path.
+            file_name (str): The name of the file to be uploaded.
+            size (int): The size of the upload in bytes.
+
+        Raises:
+            ValueError: If the uploaded object does not match the local file.
+        """
+        blob = gcsClass.get_conn().bucket(kwargs["bucket_name"]).blob(
+            kwargs["file_name"], chunk_size=GCS_CHUNK_SIZE
+        )
+        with _open_source(**kwargs) as f:
+            reader = HashingReader(f)
+            blob.upload_from_file(reader, size=kwargs["size"], checksum=None)
+        if blob.md5_hash != reader.b64digest():
+            raise ValueError(
+                f"MD5 mismatch after uploading {kwargs['file_name']} to bucket {kwargs['bucket_name']}"
+            )
+
     def upload(self, **kwargs) -> tuple:
         """
         Uploads a file to a Google Cloud Storage (GCS) bucket using the GCSHook class.
@@ -87,57 +683,41 @@ class GcsCloudProvider(CloudProvider):
             bucket_name (str): The name of the GCS bucket.
             file_path (str): The path to the file to be uploaded.
             file_name (str): The name of the file to be uploaded.
+            file_obj (BinaryIO): An open binary file to upload instead of file_path, e.g. a spooled export. Not closed.
             provider_secret_env_name (str): The name of the environment variable containing the credentials for the GCS account.
             release_name (str): The name of the release.
+            skip_unchanged (bool): Skip the upload when the destination already holds the same content. Default True.
 
         Returns:
             tuple: A tuple containing a boolean value indicating success or failure, the release name, the provider, and any exception that occurred.
         """
         try:
-            from airflow.providers.google.cloud.operators.gcs import GCSHook
-
-            logging.info(
+            size = _source_size(**kwargs)
+            log.debug(
                 "Connecting to gcs service to validate bucket connection........"
             )
-            if not kwargs["conn_id"] or kwargs["conn_id"] is None:
-                if (
-                    os.getenv(kwargs["provider_secret_env_name"])
-                    == "google-cloud-platform://"
-                ):
-                    logging.info(
-                        "configuring workload identity for  google connection flow"
-                    )
-                    os.environ[
-                        "AIRFLOW_CONN_GOOGLE_CLOUD_DEFAULT"
-                    ] = "google-cloud-platform://"
-                else:
-                    logging.info(
-                        "fallback to google connection default connection flow"
-                    )
-                    os.environ["AIRFLOW_CONN_GOOGLE_CLOUD_DEFAULT"] = os.getenv(
-                        kwargs["provider_secret_env_name"]
-                    )
-                    os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = os.getenv(
-                        kwargs["provider_secret_env_name"]
-                    )
-                gcsClass = GCSHook()
+            gcsClass = _cached_hook(
+                self.provider,
+                kwargs["conn_id"] or kwargs["provider_secret_env_name"],
+                lambda: self._build_hook(**kwargs),
+            )
+            if self._already_uploaded(gcsClass, **kwargs, size=size):
+                return True, kwargs["release_name"], self.provider, None
+            if kwargs.get("file_obj") is not None or size <= GCS_MULTIPART_UPLOAD_SIZE:
+                self._upload_verified(gcsClass, **kwargs, size=size)
+            elif size > GCS_CHUNK_SIZE:
+                self._upload_chunks(gcsClass, **kwargs)
             else:
-                logging.info(
-                    "Connecting to google service using conn_id flow for workload identity"
+                gcsClass.upload(
+                    bucket_name=kwargs["bucket_name"],
+                    filename=kwargs["file_path"],
+                    object_name=kwargs["file_name"],
                 )
-                if kwargs["conn_id"] == "google-cloud-platform://":
-                    logging.info("configuring workload identity for conn_id flow")
-                    os.environ[
-                        "AIRFLOW_CONN_GOOGLE_CLOUD_DEFAULT"
-                    ] = "google-cloud-platform://"
-                    gcsClass = GCSHook()
-                else:
-                    logging.info("Connecting to google service using conn_id flow")
-                    gcsClass = GCSHook(gcp_conn_id=kwargs["conn_id"])
-            gcsClass.upload(
-                bucket_name=kwargs["bucket_name"],
-                filename=kwargs["file_path"],
-                object_name=kwargs["file_name"],
+            log.info(
+                "Uploaded %s to %s bucket %s",
+                kwargs["file_name"],
+                self.provider,
+                kwargs["bucket_name"],
             )
             return True, kwargs["release_name"], self.provider, None
         except Exception as e:
@@ -155,9 +735,33 @@ class AzureCloudProvider(CloudProvider):
         """
         super().__init__(provider, **kwargs)
 
+    def _check_errors(self) -> tuple:
+        from azure.core.exceptions import AzureError
+
+        return (AzureError,)
+
+    def _is_unchanged(
+        self, blobClient, bucket_name: str, file_name: str, source, size: int
+    ) -> bool:
+        # Azure records a Content-MD5 for blobs uploaded in a single request only,
+        # blobs staged as several blocks are always uploaded again
+        from azure.core.exceptions import ResourceNotFoundError
+
+        try:
+            properties = blobClient.get_blob_properties()
+        except ResourceNotFoundError:
+            return False
+        content_md5 = properties.content_settings.content_md5
+        return (
+            properties.size == size
+            and bool(content_md5)
+            and bytes(content_md5) == _file_md5(source)[0].digest()
+        )
+
     def upload(self, **kwargs) -> tuple:
         """
-        Uploads a file to an Azure Blob Storage (ABS) container using the WasbHook class.
+        Uploads a file to an Azure Blob Storage (ABS) container with the blob client of the WasbHook connection,
+        staging blocks in parallel and replacing any existing blob.
 
         Args:
             provider (str): The name of the cloud provider. In this case, it should be "azure".
@@ -165,25 +769,44 @@ class AzureCloudProvider(CloudProvider):
             bucket_name (str): The name of the ABS container.
             file_path (str): The path to the file to be uploaded.
             file_name (str): The name of the file to be uploaded.
+            file_obj (BinaryIO): An open binary file to upload instead of file_path, e.g. a spooled export. Not closed.
             provider_secret_env_name (str): The name of the environment variable containing the credentials for the ABS account.
             release_name (str): The name of the release.
+            skip_unchanged (bool): Skip the upload when the destination already holds the same content. Default True.
 
         Returns:
             tuple: A tuple containing a boolean value indicating success or failure, the release name, the provider, and any exception that occurred.
         """
         try:
-            from airflow.providers.microsoft.azure.hooks.wasb import WasbHook
-
-            logging.info(
+            size = _source_size(**kwargs)
+            log.debug(
                 "Connecting to azure blob service to validate bucket connection........"
             )
-            azureClass = WasbHook(wasb_conn_id=kwargs["conn_id"])
-            with open(kwargs["file_path"], "rb") as f:
-                azureClass.upload(
-                    container_name=kwargs["bucket_name"],
+            # WasbHook.get_conn builds a new BlobServiceClient on every call, so the client is cached
+            blobServiceClient = _cached_hook(
+                self.provider,
+                kwargs["conn_id"],
+                lambda: _wasbhook_cls()(wasb_conn_id=kwargs["conn_id"]).get_conn(),
+            )
+            blobClient = blobServiceClient.get_blob_client(
+                container=kwargs["bucket_name"], blob=kwargs["file_name"]
+            )
+            if self._already_uploaded(blobClient, **kwargs, size=size):
+                return True, kwargs["release_name"], self.provider, None
+            with _open_source(**kwargs) as f:
+                # a known length lets the SDK stage blocks in parallel
+                blobClient.upload_blob(
                     data=f,
-                    blob_name=kwargs["file_name"],
+                    length=size,
+                    max_concurrency=AZURE_MAX_CONCURRENCY,
+                    overwrite=True,
                 )
+            log.info(
+                "Uploaded %s to %s bucket %s",
+                kwargs["file_name"],
+                self.provider,
+                kwargs["bucket_name"],
+            )
             return True, kwargs["release_name"], self.provider, None
         except Exception as e:
             return False, kwargs["release_name"], self.provider, e
@@ -200,6 +823,20 @@ class LocalProvider(CloudProvider):
         """
         super().__init__(provider, **kwargs)
 
+    def _check_errors(self) -> tuple:
+        return (OSError,)
+
+    def _is_unchanged(
+        self, destinationPath, bucket_name: str, file_name: str, source, size: int
+    ) -> bool:
+        if not destinationPath.exists() or destinationPath.stat().st_size != size:
+            return False
+        return (
+            (isinstance(source, str) and destinationPath.samefile(source))
+            or _file_md5(str(destinationPath))[0].digest()
+            == _file_md5(source)[0].digest()
+        )
+
     def upload(self, **kwargs) -> tuple:
         """
         Uploads a file to a local directory.
@@ -208,19 +845,29 @@ class LocalProvider(CloudProvider):
             provider (str): The name of the cloud provider. In this case, it should be "local".
             file_path (str): The path to the file to be uploaded.
             file_name (str): The name of the file to be uploaded.
+            file_obj (BinaryIO): An open binary file to upload instead of file_path, e.g. a spooled export. Not closed.
             release_name (str): The name of the release.
+            skip_unchanged (bool): Skip the upload when the destination already holds the same content. Default True.
 
         Returns:
             tuple: A tuple containing a boolean value indicating success or failure, the release name, the provider, and any exception that occurred.
         """
         try:
-            destinationPath = os.path.join(
-                "/tmp", kwargs["bucket_name"], kwargs["file_name"]
-            )
-            if not os.path.exists(destinationPath):
-                os.makedirs(os.path.dirname(destinationPath), exist_ok=True)
-            shutil.copy(kwargs["file_path"], destinationPath)
-            logging.debug(f"File copied to {destinationPath}")
+            size = _source_size(**kwargs)
+            destinationPath = Path("/tmp", kwargs["bucket_name"], kwargs["file_name"])
+            if self._already_uploaded(destinationPath, **kwargs, size=size):
+                return True, kwargs["release_name"], self.provider, None
+            destinationPath.parent.mkdir(parents=True, exist_ok=True)
+            # never write through a hard link left by earlier versions into its source file
+            if destinationPath.exists():
+                destinationPath.unlink()
+            if kwargs.get("file_obj") is not None:
+                with open(destinationPath, "wb") as f:
+                    shutil.copyfileobj(kwargs["file_obj"], f, FILE_READ_BUFFER_SIZE)
+            else:
+                # always a copy, a hard link would let later writes to the source change the archive
+                _copy_file(kwargs["file_path"], destinationPath)
+            log.debug("File copied to %s", destinationPath)
             return True, kwargs["release_name"], self.provider, None
         except Exception as e:
             return False, kwargs["release_name"], self.provider, e
@@ -232,3 +879,23 @@ ProviderFactory = {
     "azure": AzureCloudProvider,
     "local": LocalProvider,
 }
+
+
+def _upload_job(job: dict) -> tuple:
+    provider = job["provider"]
+    return ProviderFactory[provider](provider).upload(**job)
+
+
+def upload_many(jobs: list[dict], max_workers: int = MAX_CONCURRENT_UPLOADS) -> list[tuple]:
+    """
+    Uploads several files concurrently, each job holding the provider name and the upload arguments.
+
+    Args:
+        jobs (list[dict]): The upload jobs, each one passed as keyword arguments to the provider upload.
+        max_workers (int): The maximum number of uploads running at the same time.
+
+    Returns:
+        list[tuple]: The upload result tuples, in the order of the given jobs.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(_upload_job, jobs))
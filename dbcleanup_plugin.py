@@ -1,17 +1,25 @@
 from __future__ import annotations
+import contextlib
 import csv
+import gzip
+import importlib
+import io
 import os
+import tempfile
 import logging
 import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from types import MappingProxyType
 
 from flask import Blueprint, request, Response, flash, redirect, render_template, g
 from flask_appbuilder import BaseView as AppBuilderBaseView
 from flask_appbuilder import expose
 from flask_login.utils import _get_user
-from flask_jwt_extended.view_decorators import jwt_required, verify_jwt_in_request
-from functools import wraps
-from sqlalchemy.orm import Session
-from sqlalchemy import inspect, text
+from flask_jwt_extended.view_decorators import verify_jwt_in_request
+from functools import lru_cache, wraps
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy import MetaData, Table, inspect, select, text, types
 
 
 from airflow.www.app import csrf
@@ -22,8 +30,8 @@ from airflow.utils import db_cleanup, dates
 from airflow.utils.db_cleanup import config_dict
 from airflow.settings import conf
 
-from .cloud_providers import ProviderFactory
-from .utils import env_check
+from .cloud_providers import MAX_CONCURRENT_UPLOADS, CloudProvider, ProviderFactory
+from .utils import env_check, json_dumps
 from typing import Callable, TypeVar, cast, Sequence
 
 T = TypeVar("T", bound=Callable)
@@ -85,12 +93,14 @@ except ImportError:
     has_access = has_access_
 
 def jwt_token_secure(func):
+    @wraps(func)
     def jwt_secure_check(arg):
         log.info("Rest_API_Plugin.jwt_token_secure() called")
         if _get_user().is_anonymous is False:
             return func(arg)
+        # raises when the request carries no valid token, so func only runs once and only when allowed
         verify_jwt_in_request()
-        return jwt_required(func(arg))
+        return func(arg)
 
     return jwt_secure_check
 
@@ -104,6 +114,31 @@ bp = Blueprint(
 )
 
 ARCHIVE_TABLE_PREFIX = "_airflow_deleted__"
+WRITE_BUFFER_SIZE = 1024 * 1024
+EXPORT_FORMATS = ("csv", "parquet")
+EXPORT_BATCH_SIZE = 10000
+# batches are gathered into row groups of this many rows, larger groups encode and compress better
+PARQUET_ROW_GROUP_SIZE = 50000
+# templates of the response messages, formatted only on the path that returns them
+EXPORT_COMPLETED_MESSAGE = "{} data exported to provider {} completed".format
+DRY_RUN_MESSAGE = "skipping export for {} as dry run is enabled".format
+NOTHING_EXPORTED_MESSAGE = "no archived data of {} to export".format
+EXPORT_FAILED_MESSAGE = "db export failed with exception {}".format
+# compression of csv exports and the suffix it adds to the file name
+EXPORT_COMPRESSIONS = {"none": "", "gzip": ".gz", "zstd": ".zst", "lz4": ".lz4"}
+# optional modules of export formats and compressions, each installed by the extra of the same name
+EXPORT_OPTIONAL_MODULES = {
+    "parquet": ("Export format", "pyarrow.parquet"),
+    "zstd": ("Compression", "zstandard"),
+    "lz4": ("Compression", "lz4.frame"),
+}
+# bounded by the uploads the S3 connection pool is sized for
+EXPORT_MAX_WORKERS = MAX_CONCURRENT_UPLOADS
+# exports up to this size stay in memory, larger ones spill to a temporary file
+EXPORT_SPOOL_MAX_SIZE = 16 * 1024 * 1024
+
+
+_BOOL_MAP = {"t": True, "true": True, "1": True, "f": False, "false": False, "0": False}
 
 
 # code sourced from airflow logic
@@ -123,11 +158,9 @@ def getboolean(val: str) -> bool:
         False
     """
     val = val.lower().strip()
-    if val in {"t", "true", "1"}:
-        return True
-    elif val in {"f", "false", "0"}:
-        return False
-    else:
+    try:
+        return _BOOL_MAP[val]
+    except KeyError:
         raise ValueError(
             "Failed to convert value to bool. Expected bool but got something else."
             f'Current value: "{val}".'
@@ -136,35 +169,32 @@ def getboolean(val: str) -> bool:
 
 # Added custom export function to be called via endpoint
 def _airflow_dbexport():
-    validate_dry_run = request.args.get("dryRun", type=str, default="True")
-    validate_days = abs(request.args.get("olderThan", type=int))
-    validate_export_format = request.args.get("exportFormat", type=str, default="csv")
-    validate_output_path = request.args.get("outputPath", type=str, default="/tmp")
-    validate_provider = request.args.get("provider", type=str, default="")
-    validate_conn_id = request.args.get("connectionId", type=str, default="")
-    validate_bucket_name = request.args.get("bucketName", type=str, default="")
-    validate_provider_secret_env_name = request.args.get(
-        "providerEnvSecretName", type=str, default=""
-    )
-    validate_drop_archives = request.args.get("purgeTable", type=str, default="False")
-    validate_deployment_name = request.args.get("deploymentName", type=str, default="")
-    validate_table_names = [
-        x.strip()
-        for x in request.args.get("tableNames", default="").split(",")
-        if x.strip() != ""
-    ]
+    # request.args is parsed once, and type= already hands back values of the right type
+    args = request.args
     try:
-        dry_run = getboolean(validate_dry_run)
-        days = int(validate_days)
-        export_format = str(validate_export_format)
-        output_path = str(validate_output_path)
-        provider = str(validate_provider)
-        bucket_name = str(validate_bucket_name)
-        drop_archives = getboolean(validate_drop_archives)
-        deployment_name = str(validate_deployment_name)
-        conn_id = str(validate_conn_id)
-        provider_secret_env_name = str(validate_provider_secret_env_name)
-        table_names = list(validate_table_names)
+        dry_run = getboolean(args.get("dryRun", default="True"))
+        # type=int hands back None both when olderThan is missing and when it is not a number
+        days = args.get("olderThan", type=int)
+        if days is None:
+            raise ValueError("olderThan is required and must be a whole number of days")
+        days = abs(days)
+        export_format = args.get("exportFormat", default="csv")
+        output_path = args.get("outputPath", default="/tmp")
+        provider = args.get("provider", default="")
+        bucket_name = args.get("bucketName", default="")
+        drop_archives = getboolean(args.get("purgeTable", default="False"))
+        deployment_name = args.get("deploymentName", default="")
+        conn_id = args.get("connectionId", default="")
+        provider_secret_env_name = args.get("providerEnvSecretName", default="")
+        table_names = list(
+            filter(None, map(str.strip, args.get("tableNames", default="").split(",")))
+        )
+        prefix_shards = args.get("prefixShards", type=int, default=0)
+        compression = args.get("compression", default="none")
+        fetch_size = args.get("fetchSize", type=int, default=EXPORT_BATCH_SIZE)
+        exclude_columns = list(
+            filter(None, map(str.strip, args.get("excludeColumns", default="").split(",")))
+        )
 
     except ValueError as e:
         log.error(f"Validation Failed for request args: {e}")
@@ -172,7 +202,7 @@ def _airflow_dbexport():
 
     else:
         log.info(
-            f"User passing values to export function dry_run : {dry_run}, days: {days}, export_format: {export_format}, output_path: {output_path}, provider_name: {provider}, bucket_name: {bucket_name}, drop_archives: {drop_archives}, deployment_name: {deployment_name}, conn_id: {conn_id}, provider_secret_env: {provider_secret_env_name}, table_names: {table_names}"
+            f"User passing values to export function dry_run : {dry_run}, days: {days}, export_format: {export_format}, output_path: {output_path}, provider_name: {provider}, bucket_name: {bucket_name}, drop_archives: {drop_archives}, deployment_name: {deployment_name}, conn_id: {conn_id}, provider_secret_env: {provider_secret_env_name}, table_names: {table_names}, prefix_shards: {prefix_shards}, compression: {compression}, fetch_size: {fetch_size}, exclude_columns: {exclude_columns}"
         )
         return export_cleaned_records(
             dry_run=dry_run,
@@ -186,6 +216,10 @@ def _airflow_dbexport():
             bucket_name=bucket_name,
             deployment_name=deployment_name,
             table_names=table_names,
+            prefix_shards=prefix_shards,
+            compression=compression,
+            fetch_size=fetch_size,
+            exclude_columns=exclude_columns,
         )
 
 
@@ -194,39 +228,464 @@ def create_folder(folder_path: str):
         os.makedirs(folder_path, exist_ok=True)
 
 
+def _export_columns(*, target_table: str, session, exclude_columns) -> str:
+    """
+    Builds the quoted column list the table is exported with, leaving out the excluded columns.
+
+    Args:
+        target_table (str): The name of the database table to export data from.
+        session: A database session object to read the columns of the table with.
+        exclude_columns (frozenset): The names of the columns to leave out of the export.
+
+    Returns:
+        str: The comma separated column list, or * when no columns are excluded.
+
+    Raises:
+        AirflowException: If all columns of the table are excluded.
+    """
+    if not exclude_columns:
+        return "*"
+    # the table is only inspected when columns are excluded, a plain export needs no catalog query
+    quote = session.bind.dialect.identifier_preparer.quote
+    columns = [
+        quote(c["name"])
+        for c in inspect(session.connection()).get_columns(target_table)
+        if c["name"] not in exclude_columns
+    ]
+    if not columns:
+        raise AirflowException(f"All columns of table {target_table} are excluded from the export")
+    return ", ".join(columns)
+
+
+def _copy_table(*, target_table: str, file_obj, session, columns: str = "*") -> bool:
+    """
+    Dumps the table with COPY ... TO STDOUT, letting Postgres format the CSV instead of Python.
+
+    Args:
+        target_table (str): The name of the database table to export data from.
+        file_obj (BinaryIO): The binary file object to export the data to.
+        session: A database session object bound to a Postgres database.
+        columns (str): The quoted column list to export, * for all columns. Default *.
+
+    Returns:
+        bool: False when the DBAPI driver has no copy_expert (i.e. is not psycopg2) and nothing was written.
+    """
+    cursor = session.connection().connection.cursor()
+    if not hasattr(cursor, "copy_expert"):
+        cursor.close()
+        return False
+    quoted_table = session.bind.dialect.identifier_preparer.quote(target_table)
+    if columns != "*":
+        quoted_table = f"{quoted_table} ({columns})"
+    try:
+        cursor.copy_expert(f"COPY {quoted_table} TO STDOUT WITH CSV HEADER", file_obj)
+    finally:
+        cursor.close()
+    return True
+
+
+def _arrow_column(column_type) -> tuple:
+    """
+    Maps a reflected column type to the Arrow type it is exported as in parquet files.
+
+    Args:
+        column_type (TypeEngine): The SQLAlchemy type of the column.
+
+    Returns:
+        tuple: The Arrow type, and the function converting the values to it or None when they convert as they are.
+    """
+    import pyarrow as pa
+
+    if isinstance(column_type, types.Boolean):
+        return pa.bool_(), None
+    if isinstance(column_type, types.Integer):
+        return pa.int64(), None
+    if isinstance(column_type, types.Float):
+        # asdecimal floats, e.g. MySQL DOUBLE, come back as Decimal which Arrow does not take as float64
+        return pa.float64(), float if column_type.asdecimal else None
+    if isinstance(column_type, types.DateTime):
+        return pa.timestamp("us", tz="UTC" if column_type.timezone else None), None
+    if isinstance(column_type, types.Date):
+        return pa.date32(), None
+    if isinstance(column_type, types.Interval):
+        return pa.duration("us"), None
+    if isinstance(column_type, (types.LargeBinary, types.BINARY, types.VARBINARY)):
+        return pa.binary(), bytes
+    if isinstance(column_type, types.JSON):
+        return pa.string(), json.dumps
+    # text, exact numerics and anything else keep their text form as in csv exports
+    return pa.string(), str
+
+
+def _dump_table_parquet(
+    *,
+    target_table: str,
+    file_obj,
+    session,
+    table: Table | None = None,
+    fetch_size: int = EXPORT_BATCH_SIZE,
+    exclude_columns: frozenset = frozenset(),
+) -> None:
+    """
+    Dumps the table as a zstd compressed parquet file, built batch by batch from the cursor.
+
+    Args:
+        target_table (str): The name of the database table to export data from.
+        file_obj (BinaryIO): The binary file object to export the data to.
+        session: A database session object to execute the export query.
+        table (Table): The table already reflected by the caller. Reflected here when not given.
+        fetch_size (int): The number of rows fetched from the cursor per batch. Default EXPORT_BATCH_SIZE.
+        exclude_columns (frozenset): The names of the columns to leave out of the export. Default none.
+
+    Raises:
+        AirflowException: If pyarrow is not installed or all columns are excluded.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise AirflowException(
+            "Export format parquet requires pyarrow, install astronomer-dbcleanup-plugin[parquet]"
+        )
+    # the reflected table types the result, so values come back as Python objects and not raw strings
+    if table is None:
+        table = Table(target_table, MetaData(), autoload_with=session.connection())
+    table_columns = [c for c in table.columns if c.name not in exclude_columns]
+    if not table_columns:
+        raise AirflowException(f"All columns of table {target_table} are excluded from the export")
+    columns = [(c.name, *_arrow_column(c.type)) for c in table_columns]
+    schema = pa.schema([(name, arrow_type) for name, arrow_type, _ in columns])
+    cursor = session.execute(
+        select(*table_columns),
+        execution_options={"stream_results": True, "max_row_buffer": fetch_size},
+    )
+    with pq.ParquetWriter(file_obj, schema, compression="zstd") as writer:
+        batches = []
+        batched_rows = 0
+        for rows in cursor.partitions(fetch_size):
+            arrays = []
+            for values, (_, arrow_type, convert) in zip(zip(*rows), columns):
+                if convert is not None:
+                    values = [None if x is None else convert(x) for x in values]
+                arrays.append(pa.array(values, type=arrow_type))
+            batches.append(pa.RecordBatch.from_arrays(arrays, schema=schema))
+            batched_rows += len(rows)
+            if batched_rows >= PARQUET_ROW_GROUP_SIZE:
+                writer.write_table(pa.Table.from_batches(batches, schema=schema))
+                batches = []
+                batched_rows = 0
+        if batches:
+            writer.write_table(pa.Table.from_batches(batches, schema=schema))
+
+
 # Adopted most of the work from @ephraimbuddy
-def _dump_table_to_file(
-    *, target_table: str, file_path: str, export_format: str, session
+def _dump_table(
+    *,
+    target_table: str,
+    file_obj,
+    export_format: str,
+    session,
+    table: Table | None = None,
+    fetch_size: int = EXPORT_BATCH_SIZE,
+    exclude_columns: frozenset = frozenset(),
 ) -> None:
     """
-    Dumps the data from the given database table into a file in the specified export format.
+    Dumps the data from the given database table into a binary file object in the specified export format.
 
     Args:
         target_table (str): The name of the database table to export data from.
-        file_path (str): The path of the file to export the data to.
-        export_format (str): The format in which to export the data. Currently, only 'csv' format is supported.
+        file_obj (BinaryIO): The binary file object to export the data to, e.g. an _ExportSpool.
+        export_format (str): The format in which to export the data, 'csv' or 'parquet'.
         session: A database session object to execute the export query.
+        table (Table): The reflected table, used by parquet exports. Default None (reflected when needed).
+        fetch_size (int): The number of rows fetched from the cursor per batch. Default EXPORT_BATCH_SIZE.
+        exclude_columns (frozenset): The names of the columns to leave out of the export. Default none.
 
-    Returns:
-        None
+    Raises:
+        AirflowException: If the specified export format is not supported or all columns are excluded.
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise AirflowException(
+            f"Export format {export_format} is not supported. Currently supported formats are csv and parquet"
+        )
+    if export_format == "parquet":
+        _dump_table_parquet(
+            target_table=target_table,
+            file_obj=file_obj,
+            session=session,
+            table=table,
+            fetch_size=fetch_size,
+            exclude_columns=exclude_columns,
+        )
+        return
+    columns = _export_columns(
+        target_table=target_table, session=session, exclude_columns=exclude_columns
+    )
+    if session.bind.dialect.name == "postgresql" and _copy_table(
+        target_table=target_table, file_obj=file_obj, session=session, columns=columns
+    ):
+        return
+    quoted_table = session.bind.dialect.identifier_preparer.quote(target_table)
+    # a server side cursor keeps only one batch of fetch_size rows in memory at a time
+    cursor = session.execute(
+        text(f"SELECT {columns} FROM {quoted_table}"),
+        execution_options={"stream_results": True, "max_row_buffer": fetch_size},
+    )
+    # each batch is formatted in memory and written to the file object encoded in one go
+    buffer = io.StringIO(newline="")
+    csv_writer = csv.writer(buffer)
+    csv_writer.writerow(cursor.keys())
+    writerows = csv_writer.writerows
+    write = file_obj.write
+    for rows in cursor.partitions(fetch_size):
+        writerows(rows)
+        write(buffer.getvalue().encode("utf-8"))
+        buffer.seek(0)
+        buffer.truncate()
+    write(buffer.getvalue().encode("utf-8"))
+
+
+def _check_optional_modules(*names: str) -> None:
+    """
+    Imports the optional modules the given export format and compression need, so a missing one fails the
+    request before the cleanup archives any rows, not in the export workers afterwards.
+
+    Args:
+        *names (str): The export format and compression of the request.
 
     Raises:
-        AirflowException: If the specified export format is not supported.
+        AirflowException: If an optional module is not installed.
+    """
+    for name in names:
+        if name not in EXPORT_OPTIONAL_MODULES:
+            continue
+        kind, module = EXPORT_OPTIONAL_MODULES[name]
+        try:
+            importlib.import_module(module)
+        except ImportError:
+            raise AirflowException(
+                f"{kind} {name} requires {module.split('.')[0]}, install astronomer-dbcleanup-plugin[{name}]"
+            )
+
 
-    Example usage:
-        _dump_table_to_file(target_table='users', file_path='/path/to/exported_file.csv', export_format='csv', session=db_session)
+def _compressor(file_obj, compression: str):
     """
-    if export_format != "csv":
-        raise AirflowException(
-            f"Export format {export_format} is not supported. Currently supported formats is csv"
+    Wraps the binary file object in a streaming compressor. Closing the compressor flushes it but leaves
+    the file object open.
+
+    Args:
+        file_obj (BinaryIO): The binary file object the compressed data is written to.
+        compression (str): One of EXPORT_COMPRESSIONS.
+
+    Returns:
+        ContextManager: The file object to export the data to.
+    """
+    if compression == "gzip":
+        # level 1 costs little CPU and still shrinks the repetitive archive data several times, and mtime=0
+        # keeps the timestamp out of the header so the same data always compresses to the same bytes
+        try:
+            from isal import igzip
+
+            return igzip.IGzipFile(fileobj=file_obj, mode="wb", compresslevel=1, mtime=0)
+        except ImportError:
+            return gzip.GzipFile(fileobj=file_obj, mode="wb", compresslevel=1, mtime=0)
+    if compression == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            raise AirflowException(
+                "Compression zstd requires zstandard, install astronomer-dbcleanup-plugin[zstd]"
+            )
+        # threads=-1 compresses on all cores while the export keeps writing
+        return zstandard.ZstdCompressor(level=3, threads=-1).stream_writer(
+            file_obj, closefd=False
+        )
+    if compression == "lz4":
+        try:
+            import lz4.frame
+        except ImportError:
+            raise AirflowException(
+                "Compression lz4 requires lz4, install astronomer-dbcleanup-plugin[lz4]"
+            )
+        # the cheapest of the codecs, for fast local or network mounts where gzip would be the bottleneck
+        return lz4.frame.LZ4FrameFile(file_obj, mode="wb")
+    return contextlib.nullcontext(file_obj)
+
+
+class _ExportSpool:
+    """
+    The binary file a table is exported to. The data stays in memory up to max_size and moves to a named
+    temporary file in dir once it grows beyond, so large exports are uploaded by path: providers can then
+    upload them in parallel parts and hash them through a memory map. The file is removed on exit.
+    """
+
+    def __init__(self, max_size: int, dir: str):
+        self.max_size = max_size
+        self.dir = dir
+        self.file = io.BytesIO()
+        self.name = None
+
+    def write(self, data) -> int:
+        written = self.file.write(data)
+        if self.name is None and self.file.tell() > self.max_size:
+            self._rollover()
+        return written
+
+    def _rollover(self) -> None:
+        spilled = tempfile.NamedTemporaryFile(
+            dir=self.dir, buffering=WRITE_BUFFER_SIZE, delete=False
+        )
+        self.name = spilled.name
+        spilled.write(self.file.getbuffer())
+        self.file = spilled
+
+    @property
+    def closed(self) -> bool:
+        return self.file.closed
+
+    def tell(self) -> int:
+        return self.file.tell()
+
+    def flush(self) -> None:
+        self.file.flush()
+
+    def upload_source(self) -> dict:
+        """
+        Returns the upload arguments reading the exported data: file_path once spilled, file_obj otherwise.
+        """
+        if self.name is None:
+            self.file.seek(0)
+            return {"file_obj": self.file}
+        self.file.close()
+        return {"file_path": self.name}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.file.close()
+        if self.name is not None:
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(self.name)
+
+
+def _export_table(
+    *,
+    table_name: str,
+    output_path: str,
+    export_format: str,
+    uploader: CloudProvider,
+    release_name: str,
+    session_factory: Callable[[], Session],
+    compression: str = "none",
+    table: Table | None = None,
+    fetch_size: int = EXPORT_BATCH_SIZE,
+    exclude_columns: frozenset = frozenset(),
+    **upload_kwargs,
+) -> tuple:
+    """
+    Dumps one archive table into an _ExportSpool and uploads it to the provider straight from there, so
+    small tables never touch the disk and large ones are uploaded by path. Runs in a worker thread, so it reads through a session
+    of its own.
+
+    Args:
+        table_name (str): The name of the archive table to export.
+        output_path (str): The directory the export spills to once it outgrows memory.
+        export_format (str): The format in which to export the data.
+        uploader (CloudProvider): The provider instance to upload with, shared by all workers.
+        release_name (str): The name of the release, used as the prefix of the uploaded file.
+        session_factory (Callable): Creates the database session of the worker.
+        compression (str): The compression of the exported file, one of EXPORT_COMPRESSIONS. Default none.
+        table (Table): The reflected archive table, for parquet exports. Default None.
+        fetch_size (int): The number of rows fetched from the cursor per batch. Default EXPORT_BATCH_SIZE.
+        exclude_columns (frozenset): The names of the columns to leave out of the export. Default none.
+        **upload_kwargs: Passed on to the upload of the provider.
+
+    Returns:
+        tuple: A boolean value indicating success or failure and any exception that occurred.
+    """
+    logging.info("Exporting table %s", table_name)
+    with _ExportSpool(EXPORT_SPOOL_MAX_SIZE, output_path) as spool:
+        with session_factory() as session, _compressor(spool, compression) as out:
+            _dump_table(
+                target_table=table_name,
+                file_obj=out,
+                export_format=export_format,
+                session=session,
+                table=table,
+                fetch_size=fetch_size,
+                exclude_columns=exclude_columns,
+            )
+        status, _, _, e = uploader.upload(
+            **spool.upload_source(),
+            file_name=f"{release_name}/{table_name}.{export_format}{EXPORT_COMPRESSIONS[compression]}",
+            release_name=release_name,
+            **upload_kwargs,
         )
-    cursor = session.execute(text(f"SELECT * FROM {target_table}"))
-    batch_size = 5000
-    while rows := cursor.fetchmany(batch_size):
-        with open(file_path, "a+") as f:
-            csv_writer = csv.writer(f)
-            csv_writer.writerow(cursor.keys())
-            csv_writer.writerows(rows)
+    return status, e
+
+
+_ARCHIVE_TABLE_QUERIES = {
+    "postgresql": "SELECT tablename FROM pg_tables WHERE schemaname = current_schema() AND tablename LIKE :pattern ESCAPE '|'",
+    "mysql": "SELECT table_name FROM information_schema.tables WHERE table_schema = DATABASE() AND table_type = 'BASE TABLE' AND table_name LIKE :pattern ESCAPE '|'",
+    "sqlite": "SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE :pattern ESCAPE '|'",
+}
+
+
+def _list_archive_tables(session) -> list[str]:
+    """
+    Lists the archive tables of the default schema, letting the database filter its catalog on the archive
+    prefix instead of reflecting every table name. Other databases go through the SQLAlchemy inspector.
+
+    Args:
+        session: A database session object to query the catalog with.
+
+    Returns:
+        list[str]: The names of the tables starting with the archive prefix.
+    """
+    query = _ARCHIVE_TABLE_QUERIES.get(session.bind.dialect.name)
+    if query is None:
+        return [
+            x
+            for x in inspect(session.bind).get_table_names()
+            if x.startswith(ARCHIVE_TABLE_PREFIX)
+        ]
+    # "_" is a LIKE wildcard, so the underscores of the prefix are escaped
+    pattern = ARCHIVE_TABLE_PREFIX.replace("_", "|_") + "%"
+    return list(session.execute(text(query), {"pattern": pattern}).scalars())
+
+
+def _drop_archive_tables(*, table_names: list[str], session) -> None:
+    """
+    Drops the exported archive tables with a single DROP TABLE statement on databases taking a list of
+    tables, and one statement per table on sqlite or when the single statement is rejected.
+
+    Args:
+        table_names (list[str]): The names of the archive tables to drop.
+        session: A database session object to execute the statements.
+    """
+    preparer = session.bind.dialect.identifier_preparer
+    quoted_tables = [preparer.quote(x) for x in table_names]
+    if session.bind.dialect.name != "sqlite":
+        try:
+            session.execute(text(f"DROP TABLE IF EXISTS {', '.join(quoted_tables)}"))
+            return
+        except DBAPIError as e:
+            log.warning("Dropping the archive tables at once failed, dropping them one by one: %s", e)
+            session.rollback()
+    for quoted_table in quoted_tables:
+        session.execute(text(f"DROP TABLE IF EXISTS {quoted_table}"))
+
+
+@lru_cache(maxsize=32)
+def _effective_table_names_cached(desired_table_names: frozenset):
+    """
+    Return the effective table names of the desired ones and their configuration. Scheduled exports send
+    the same table names on every run, so the result is cached, read-only so callers cannot change it.
+    """
+    effective_table_names = frozenset(desired_table_names & config_dict.keys())
+    effective_config_dict = MappingProxyType({k: config_dict[k] for k in effective_table_names})
+    return effective_table_names, effective_config_dict
 
 
 def _effective_table_names(*, table_names: list[str]):
@@ -235,16 +694,10 @@ def _effective_table_names(*, table_names: list[str]):
     If no table names are specified, returns all table names in the global configuration.
     Raises SystemExit if no valid table names are selected.
     """
-    desired_table_names = set(
-        table_names if len(table_names) > 0 else config_dict.keys()
-    )
-    # desired_table_names = set(table_names or config_dict)
-    effective_config_dict = {
-        k: v for k, v in config_dict.items() if k in desired_table_names
-    }
-    effective_table_names = set(effective_config_dict)
-    if desired_table_names != effective_table_names:
-        outliers = desired_table_names - effective_table_names
+    desired_table_names = frozenset(table_names or config_dict)
+    effective_table_names, effective_config_dict = _effective_table_names_cached(desired_table_names)
+    outliers = desired_table_names - effective_table_names
+    if outliers:
         logging.warning(
             "The following table(s) are not valid choices and will be skipped: %s",
             sorted(outliers),
@@ -269,6 +722,10 @@ def export_cleaned_records(
     drop_archives,
     deployment_name,
     table_names,
+    prefix_shards=0,
+    compression="none",
+    fetch_size=EXPORT_BATCH_SIZE,
+    exclude_columns=(),
     session: Session = NEW_SESSION,
 ):
     """Export cleaned data to the given output path in the given format."""
@@ -280,21 +737,37 @@ def export_cleaned_records(
         raise AirflowException(
             f"Provider {provider} is not supported. Currently supported providers are aws, gcp, azure and local"
         )
+    # the request is validated in full before the cleanup moves any rows to archive tables
+    if export_format not in EXPORT_FORMATS:
+        raise AirflowException(
+            f"Export format {export_format} is not supported. Currently supported formats are csv and parquet"
+        )
+    if compression not in EXPORT_COMPRESSIONS:
+        raise AirflowException(
+            f"Compression {compression} is not supported. Currently supported compressions are none, gzip, zstd and lz4"
+        )
+    if fetch_size < 1:
+        raise AirflowException(f"Fetch size must be a positive number of rows, got {fetch_size}")
+    if export_format != "csv" and compression != "none":
+        # parquet files compress their pages themselves
+        logging.warning("Compression %s applies to csv exports only, ignoring it", compression)
+        compression = "none"
+    _check_optional_modules(export_format, compression)
     create_folder(output_path)
-    file_name = "verify.txt"
-    file_path = os.path.join(output_path, f"{file_name}")
-    file_name = f"{release_name}/{file_name}"
-    with open(file_path, "w") as file:
-        data = f"Adding demo content for {release_name} to verify bucket existence"
-        file.write(data)
+    file_name = f"{release_name}/verify.txt"
+    # the verify content is small enough to upload from memory
+    data = f"Adding demo content for {release_name} to verify bucket existence"
     provider_base = ProviderFactory[provider](provider)
     status, release_name, provider, e = provider_base.upload(
         conn_id=conn_id,
         bucket_name=bucket_name,
-        file_path=file_path,
+        file_obj=io.BytesIO(data.encode("utf-8")),
         file_name=file_name,
         provider_secret_env_name=provider_secret_env_name,
-        release_name=release_name
+        release_name=release_name,
+        prefix_shards=prefix_shards,
+        # always write, the point of this upload is to check the credentials can
+        skip_unchanged=False,
     )
 
     if not status:
@@ -310,42 +783,68 @@ def export_cleaned_records(
         logging.info("DBcleanup completed successfully....")
         logging.info("DBcleanup proceeding with export selection")
         effective_table_names, _ = _effective_table_names(table_names=table_names)
-        inspector = inspect(session.bind)
-        db_table_names = [
-            x for x in inspector.get_table_names() if x.startswith(ARCHIVE_TABLE_PREFIX)
+        # archive tables are named <prefix><table>__<timestamp>, the parsed table name decides
+        export_table_names = [
+            x
+            for x in _list_archive_tables(session)
+            if x[len(ARCHIVE_TABLE_PREFIX) :].rsplit("__", 1)[0] in effective_table_names
         ]
+        if not export_table_names:
+            logging.info("No archive tables to export")
+            return (
+                True,
+                release_name,
+                provider,
+                "",
+                NOTHING_EXPORTED_MESSAGE(release_name),
+            )
         export_count = 0
         dropped_count = 0
-        for table_name in db_table_names:
-            if all(f"__{x}__" not in table_name for x in effective_table_names):
-                continue
-            logging.info("Exporting table %s", table_name)
-            os.makedirs(output_path, exist_ok=True)
-            _dump_table_to_file(
-                target_table=table_name,
-                file_path=os.path.join(output_path, f"{table_name}.{export_format}"),
-                export_format=export_format,
-                session=session,
-            )
-            export_count += 1
-            file_path = os.path.join(output_path, f"{table_name}.{export_format}")
-            file_name = f"{release_name}/{table_name}.{export_format}"
-            provider = ProviderFactory[provider](provider)
-            status, release_name, provider, e = provider.upload(
-                conn_id=conn_id,
-                bucket_name=bucket_name,
-                file_path=file_path,
-                file_name=file_name,
-                provider_secret_env_name=provider_secret_env_name,
-                release_name=release_name,
-            )
-            if not status:
-                return False, release_name, provider, e, ""
-            if drop_archives:
-                os.remove(file_path)
-                logging.info("Dropping archived table %s", table_name)
-                session.execute(text(f"DROP TABLE {table_name}"))
-                dropped_count += 1
+        # dumps and uploads are I/O bound, so the tables are exported concurrently
+        session_factory = sessionmaker(bind=session.bind)
+        exclude_columns = frozenset(exclude_columns)
+        archive_tables = {}
+        if export_format == "parquet":
+            # one reflect call reads the columns of all archive tables in a few catalog queries
+            archive_metadata = MetaData()
+            archive_metadata.reflect(bind=session.bind, only=export_table_names)
+            archive_tables = archive_metadata.tables
+        with ThreadPoolExecutor(
+            max_workers=min(EXPORT_MAX_WORKERS, len(export_table_names))
+        ) as executor:
+            futures = [
+                executor.submit(
+                    _export_table,
+                    table_name=table_name,
+                    output_path=output_path,
+                    export_format=export_format,
+                    uploader=provider_base,
+                    release_name=release_name,
+                    session_factory=session_factory,
+                    conn_id=conn_id,
+                    bucket_name=bucket_name,
+                    provider_secret_env_name=provider_secret_env_name,
+                    prefix_shards=prefix_shards,
+                    compression=compression,
+                    table=archive_tables.get(table_name),
+                    fetch_size=fetch_size,
+                    exclude_columns=exclude_columns,
+                )
+                for table_name in export_table_names
+            ]
+            try:
+                for future in as_completed(futures):
+                    status, e = future.result()
+                    if not status:
+                        return False, release_name, provider, e, ""
+                    export_count += 1
+            finally:
+                for future in futures:
+                    future.cancel()
+        if drop_archives:
+            logging.info("Dropping archived tables %s", export_table_names)
+            _drop_archive_tables(table_names=export_table_names, session=session)
+            dropped_count = len(export_table_names)
         logging.info(
             "Total exported tables: %s, Total dropped tables: %s",
             export_count,
@@ -357,7 +856,7 @@ def export_cleaned_records(
             release_name,
             provider,
             "",
-            f"{release_name} data exported to provider {provider} completed" "",
+            EXPORT_COMPLETED_MESSAGE(release_name, provider),
         )
     else:
         logging.info("Performing DBcleanup dry run ...")
@@ -372,7 +871,7 @@ def export_cleaned_records(
             release_name,
             provider,
             "skipping export",
-            f"skipping export for {release_name} as dry run is enabled",
+            DRY_RUN_MESSAGE(release_name),
         )
 
 
@@ -400,25 +899,25 @@ class AstronomerDbcleanup(AppBuilderBaseView):
                     "statusCode": 200,
                     "message": msg,
                 }
-                response = Response(json.dumps(res), mimetype="application/json")
+                response = Response(json_dumps(res), mimetype="application/json")
                 response.status = 200
             else:
                 res = {
                     "deploymentName": f"{release}",
                     "jobStatus": "failed",
                     "statusCode": 500,
-                    "message": f"db export failed with exception {e}",
+                    "message": EXPORT_FAILED_MESSAGE(e),
                 }
-                response = Response(json.dumps(res), mimetype="application/json")
+                response = Response(json_dumps(res), mimetype="application/json")
                 response.status = 500
             return response
         except Exception as e:
             res = {
                 "jobStatus": "failed",
                 "statusCode": 500,
-                "message": f"db export failed with exception {e}",
+                "message": EXPORT_FAILED_MESSAGE(e),
             }
-            response = Response(json.dumps(res), mimetype="application/json")
+            response = Response(json_dumps(res), mimetype="application/json")
             response.status = 500
             return response
 
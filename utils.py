@@ -2,25 +2,41 @@ from flask import Response
 import os
 import json
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def json_dumps(obj):
+    """
+    Serializes obj to JSON for a response body, with orjson when it is installed and the json module otherwise.
+    """
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj)
+
 
 class env_check(object):
     def __init__(self, env_var):
         self.env_var = env_var
 
     def __call__(self, f):
-        def g(*args, **kwargs):
-            res = {
+        env_value = os.environ.get(self.env_var)
+        if env_value is None or env_value == "software":
+            return f
+        # the body never changes, so it is serialized once here, a request only wraps it in a new Response
+        body = json_dumps(
+            {
                 "jobStatus": "failed",
                 "statusCode": 501,
                 "message": "This feature is only supported on Astronomer Software and Astronomer Nebula",
             }
-            response = Response(json.dumps(res), mimetype="application/json")
+        )
+
+        def g(*args, **kwargs):
+            response = Response(body, mimetype="application/json")
             response.status_code = 501
             return response
 
-        if (
-            os.environ.get(self.env_var) is None
-            or os.environ.get(self.env_var) == "software"
-        ):
-            return f
         return g